@@ -1,9 +1,14 @@
+import bisect
+import hashlib
 import gym
 import numpy as np
 
+SLIP_MODELS = ('none', 'uniform', 'slippery')
+HOLE_PENALTY = -100.0
+
 class EnvironmentWrapper:
     def __init__(self, env_name='FrozenLake-v1', is_slippery=False, 
-                 custom_map=None, env=None):
+                 custom_map=None, env=None, slip_model=None, slip_prob=0.1):
         if env is None:
             if custom_map:
                 self.env = gym.make(env_name, desc=custom_map, is_slippery=is_slippery)
@@ -16,6 +21,7 @@ class EnvironmentWrapper:
 
         desc = self.env.unwrapped.desc.astype(str).tolist()
         self.nrow, self.ncol = len(desc), len(desc[0])
+        self.map_hash = hashlib.sha1('\n'.join(''.join(row) for row in desc).encode()).hexdigest()
         
         self.state = None
         
@@ -32,10 +38,28 @@ class EnvironmentWrapper:
                 elif cell == 'S':
                     self.start_state = i * self.ncol + j
         
+        self.terminal_states = set(self.hole_states) | {self.goal_state}
+        self.dead_end_states = set()
         self.shaped_rewards = self.calculate_shaped_reward()
+
+        if slip_model is None:
+            slip_model = self.default_slip_model(is_slippery)
+        if slip_model not in SLIP_MODELS:
+            raise ValueError(f"Unknown slip model '{slip_model}', expected one of {SLIP_MODELS}.")
+        self.slip_model = slip_model
+        self.slip_prob = slip_prob
+        self.P = self.build_transition_model()
+        self.successors = self.build_successors()
+        if self.mark_dead_ends():
+            # Rebuild so dead ends are absorbing, like holes and the goal.
+            self.P = self.build_transition_model()
+            self.successors = self.build_successors()
         
         self.reset()
 
+    def default_slip_model(self, is_slippery):
+        return 'slippery' if is_slippery else 'none'
+
     def set_state(self, state):
         self.state = state
 
@@ -49,7 +73,7 @@ class EnvironmentWrapper:
         shaped_rewards = {}
         for state in range(self.nrow * self.ncol):
             if state in self.hole_states:
-                shaped_rewards[state] = -100.0
+                shaped_rewards[state] = HOLE_PENALTY
             elif state == self.goal_state:
                 shaped_rewards[state] = 0.0
             else:
@@ -59,8 +83,8 @@ class EnvironmentWrapper:
         
         return shaped_rewards
 
-    def take_action(self, action):
-        row, col = self.state // self.ncol, self.state % self.ncol
+    def move(self, state, action):
+        row, col = state // self.ncol, state % self.ncol
         
         if action == 0:  # Left
             col = max(0, col - 1)
@@ -71,7 +95,85 @@ class EnvironmentWrapper:
         elif action == 3:  # Up
             row = max(0, row - 1)
         
-        new_state = row * self.ncol + col
+        return row * self.ncol + col
+
+    def slip_distribution(self, action):
+        n_actions = self.action_space.n
+        if self.slip_model == 'uniform':
+            probs = {a: self.slip_prob / n_actions for a in range(n_actions)}
+            probs[action] += 1.0 - self.slip_prob
+            return probs
+        if self.slip_model == 'slippery':
+            # FrozenLake slides to either perpendicular direction as often as it
+            # moves in the intended one.
+            probs = {}
+            for a in [(action - 1) % n_actions, action, (action + 1) % n_actions]:
+                probs[a] = probs.get(a, 0.0) + 1.0 / 3.0
+            return probs
+        return {action: 1.0}
+
+    def build_transition_model(self):
+        n_states = self.nrow * self.ncol
+        n_actions = self.action_space.n
+        P = np.zeros((n_states, n_actions, n_states))
+        
+        for state in range(n_states):
+            for action in range(n_actions):
+                if self.is_terminal(state):
+                    P[state, action, state] = 1.0
+                    continue
+                for slip_action, prob in self.slip_distribution(action).items():
+                    P[state, action, self.move(state, slip_action)] += prob
+        
+        return P
+
+    def build_successors(self):
+        successors = {}
+        n_states, n_actions, _ = self.P.shape
+        for state in range(n_states):
+            for action in range(n_actions):
+                next_states = np.flatnonzero(self.P[state, action]).tolist()
+                probs = self.P[state, action, next_states].tolist()
+                cumulative = np.cumsum(probs).tolist()
+                successors[(state, action)] = (next_states, probs, cumulative)
+        return successors
+
+    def mark_dead_ends(self):
+        # A state is a dead end when no sequence of actions can reach the goal
+        # from it with positive probability; it is then treated like a hole.
+        n_states, n_actions, _ = self.P.shape
+        can_reach_goal = {self.goal_state}
+        changed = True
+        while changed:
+            changed = False
+            for state in range(n_states):
+                if state in can_reach_goal or state in self.terminal_states:
+                    continue
+                if any(next_state in can_reach_goal
+                       for action in range(n_actions)
+                       for next_state in self.successors[(state, action)][0]):
+                    can_reach_goal.add(state)
+                    changed = True
+        
+        self.dead_end_states = set(range(n_states)) - can_reach_goal - self.terminal_states
+        for state in self.dead_end_states:
+            self.shaped_rewards[state] = HOLE_PENALTY
+        self.terminal_states |= self.dead_end_states
+        return bool(self.dead_end_states)
+
+    def transitions(self, state, action):
+        next_states, probs, _ = self.successors[(state, action)]
+        return zip(next_states, probs)
+
+    def sample_next_state(self, state, action):
+        next_states, _, cumulative = self.successors[(state, action)]
+        if len(next_states) == 1:
+            return next_states[0]
+        index = bisect.bisect_right(cumulative, np.random.random() * cumulative[-1])
+        return next_states[min(index, len(next_states) - 1)]
+
+    def take_action(self, action):
+        new_state = self.sample_next_state(self.state, action)
         reward = self.get_reward(new_state)
         self.state = new_state
         
@@ -87,7 +189,7 @@ class EnvironmentWrapper:
         return state in self.hole_states
 
     def is_terminal(self, state):
-        return self.is_hole(state) or self.is_goal(state)
+        return state in self.terminal_states
 
     def reset(self):
         self.state = self.start_state
@@ -106,11 +208,9 @@ class EnvironmentWrapper:
         return row * self.ncol + col
 
 class SimulatorWrapper(EnvironmentWrapper):
-    def __init__(self, env_name='FrozenLake-v1', is_slippery=False, custom_map=None, env=None):
-        super().__init__(env_name, is_slippery, custom_map, env)
+    def __init__(self, env_name='FrozenLake-v1', is_slippery=False, custom_map=None, env=None,
+                 slip_model=None, slip_prob=0.1):
+        super().__init__(env_name, is_slippery, custom_map, env, slip_model, slip_prob)
 
-    def take_action(self, action):
-        if np.random.random() < 0.1:
-            action = self.action_space.sample()
-        
-        return super().take_action(action)
\ No newline at end of file
+    def default_slip_model(self, is_slippery):
+        return 'slippery' if is_slippery else 'uniform'
\ No newline at end of file
@@ -1,5 +1,6 @@
 import math
 import random
+import time
 from collections import defaultdict
 import numpy as np
 import pdb
@@ -38,8 +39,18 @@ def get_valid_children(index, num_rows, num_cols):
     
     return children
 
+# Visiting the same state this many times in one episode counts as oscillation
+# and triggers a replan with a doubled search budget, up to MAX_BUDGET_SCALE times.
+OSCILLATION_VISITS = 3
+MAX_BUDGET_SCALE = 8
+
+def replan_budget(visits, max_iterations):
+    if visits < OSCILLATION_VISITS:
+        return max_iterations
+    return max_iterations * min(2 ** (visits - OSCILLATION_VISITS + 1), MAX_BUDGET_SCALE)
+
 class MonteCarloTreeSearch:
-    def __init__(self, env, simulator):
+    def __init__(self, env, simulator, expected_backups=True, recorder=None):
         self.env = env
         self.simulator = simulator
         self.Q = defaultdict(float)
@@ -48,6 +59,9 @@ class MonteCarloTreeSearch:
         self.exploration_weight = math.sqrt(2)
         self.max_depth = 200
         self.gamma = 0.95
+        self.expected_backups = expected_backups
+        self.recorder = recorder
+        self.trace_path = None
 
     def expand(self, state):
         if state not in self.children:
@@ -136,12 +150,17 @@ class MonteCarloTreeSearch:
         total_reward = 0
         depth = 0
         
+        visited = 1 << current_state
+        
         while not self.simulator.is_terminal(current_state) and depth < self.max_depth:
             action = self.safe_random_action(current_state)
             next_state, reward = self.simulator.take_action(action)
             total_reward += reward * (self.gamma ** depth)
             current_state = next_state
             depth += 1
+            if visited >> current_state & 1:
+                break  # Loop detected, fall back to evaluate()
+            visited |= 1 << current_state
         
         if not self.simulator.is_terminal(current_state):
             total_reward += self.evaluate(current_state) * (self.gamma ** depth)
@@ -194,20 +213,42 @@ class MonteCarloTreeSearch:
         exploration = math.sqrt(2) * math.sqrt(math.log(self.N[state] + 1) / (self.N[(state, action)] + 1e-8))
         return exploitation + exploration
 
-    def search(self, state, depth):
-        if self.env.is_terminal(state) or depth >= self.max_depth:
+    def search(self, state, depth, visited=0):
+        if self.trace_path is not None:
+            self.trace_path.append(state)
+        if self.env.is_terminal(state) or depth >= self.max_depth or visited >> state & 1:
             return self.evaluate(state)
+        visited |= 1 << state
         
         if state not in self.children:
             self.expand(state)
             return self.evaluate(state)
         
         action = self.select_action(state)
-        next_state, reward = self.simulate_action(state, action)
-        q = reward + self.gamma * self.search(next_state, depth + 1)
+        if self.expected_backups:
+            # Chance node: grow the tree along one sampled outcome, then back up
+            # the exact expectation over every known successor.
+            next_state = self.get_next_state(state, action)
+            self.search(next_state, depth + 1, visited)
+            q = self.expected_value(state, action)
+        else:
+            next_state, reward = self.simulate_action(state, action)
+            q = reward + self.gamma * self.search(next_state, depth + 1, visited)
         self.update_value(state, action, q)
         return q
 
+    def state_value(self, state):
+        if self.env.is_terminal(state) or state not in self.children:
+            return self.evaluate(state)
+        tried = [a for a in self.children[state] if self.N[(state, a)] > 0]
+        if not tried:
+            return self.evaluate(state)
+        return max(self.Q[(state, a)] for a in tried)
+
+    def expected_value(self, state, action):
+        return sum(prob * (self.simulator.get_reward(next_state) + self.gamma * self.state_value(next_state))
+                   for next_state, prob in self.simulator.transitions(state, action))
+
     def simulate_action(self, state, action):
         self.simulator.set_state(state)
         return self.simulator.take_action(action)
@@ -227,10 +268,61 @@ class MonteCarloTreeSearch:
         if state not in self.children:
             self.expand(state)
         
+        if self.recorder is None:
+            for _ in range(max_iterations):
+                self.search(state, depth=0)
+            return self.best_action(state)
+        
+        start_time = time.perf_counter()
         for _ in range(max_iterations):
-            self.search(state, depth=0)
+            if self.recorder.should_sample_path():
+                self.trace_path = []
+                self.search(state, depth=0)
+                self.recorder.record_path(self.trace_path)
+                self.trace_path = None
+            else:
+                self.search(state, depth=0)
+        action = self.best_action(state)
         
-        return self.best_action(state)
+        edges = [(a, self.N[(state, a)], self.Q[(state, a)]) for a in self.children[state]]
+        self.recorder.record_step(state, action, max_iterations, time.perf_counter() - start_time, edges)
+        return action
+
+    def principal_variation(self, state, max_length=None):
+        # Follows the best action and its most likely outcome down the tree,
+        # stopping before the line would revisit a state. Each step carries the
+        # share of the node's visits that went to that action and the
+        # probability of the outcome it expects.
+        plan = []
+        seen = {state}
+        max_length = self.max_depth if max_length is None else max_length
+        while len(plan) < max_length and not self.env.is_terminal(state) and self.children.get(state):
+            total_visits = sum(self.N[(state, a)] for a in self.children[state])
+            if total_visits == 0:
+                break
+            action = self.best_action(state)
+            if self.N[(state, action)] == 0:
+                # best_action can favour an untried edge over negative means;
+                # nothing below it has been searched.
+                break
+            confidence = self.N[(state, action)] / total_visits
+            next_state, prob = self.likely_outcome(state, action)
+            if next_state in seen:
+                break
+            plan.append((state, action, next_state, confidence, prob))
+            seen.add(next_state)
+            state = next_state
+        return plan
+
+    def likely_outcome(self, state, action):
+        # Prefer the intended move when it ties for the most likely outcome,
+        # e.g. under the slippery model where every outcome has probability 1/3.
+        outcomes = dict(self.simulator.transitions(state, action))
+        best_prob = max(outcomes.values())
+        intended = self.simulator.move(state, action)
+        if outcomes.get(intended, 0.0) == best_prob:
+            return intended, best_prob
+        return max(outcomes.items(), key=lambda t: t[1])
 
     def best_action(self, state):
         valid_actions = [a for a in self.children[state] if self.is_valid_action(state, a)]
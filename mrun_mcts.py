@@ -1,6 +1,9 @@
-from model import MonteCarloTreeSearch
-from environment_wrapper import EnvironmentWrapper, SimulatorWrapper
+from model import MonteCarloTreeSearch, replan_budget
+from environment_wrapper import EnvironmentWrapper, SimulatorWrapper, SLIP_MODELS
+from utilities.plan_cache import PlanCache
+from utilities.trace_recorder import TraceRecorder
 import random
+from collections import defaultdict
 import gym
 import matplotlib.pyplot as plt
 import time
@@ -28,16 +31,22 @@ def print_grid(env, current_state):
         print(' '.join(row))
     print()
 
-def run_episode(env, simulator, max_iterations, verbose=False):
-    mcts = MonteCarloTreeSearch(env=env, simulator=simulator)
+def run_episode(env, simulator, max_iterations, verbose=False, recorder=None, plan_cache=None):
+    mcts = MonteCarloTreeSearch(env=env, simulator=simulator, recorder=recorder)
     state = env.reset()
     done = False
     total_reward = 0
     steps = 0
+    visits = defaultdict(int)
     start_time = time.time()
 
     action_names = {0: "Left", 1: "Down", 2: "Right", 3: "Up"}
 
+    if recorder is not None:
+        recorder.start_episode()
+    if plan_cache is not None:
+        plan_cache.start_episode()
+
     if verbose:
         print("\nStarting new episode")
         print_grid(env, state)
@@ -45,14 +54,32 @@ def run_episode(env, simulator, max_iterations, verbose=False):
     while not done:
         if verbose:
             print(f"\nStep {steps}, Current State: {state}")
+        if recorder is not None:
+            recorder.set_step(steps)
+        
+        visits[state] += 1
+        budget = replan_budget(visits[state], max_iterations)
+        if verbose and budget > max_iterations:
+            print(f"Oscillation detected at state {state}, replanning with {budget} iterations")
         
-        action = mcts.monte_carlo_planning(state, max_iterations=max_iterations)
+        action = None
+        if plan_cache is not None and budget == max_iterations:
+            action = plan_cache.lookup(env.map_hash, state, budget)
+        cached = action is not None
+        if not cached:
+            action = mcts.monte_carlo_planning(state, max_iterations=budget)
+            if plan_cache is not None:
+                plan_cache.store(env.map_hash, mcts.principal_variation(state))
+        elif verbose:
+            print("Following cached plan")
         action_name = action_names[action]
         if verbose:
             print(f"Chosen action: {action} ({action_name})")
         
         env.set_state(state) 
         next_state, reward = env.take_action(action)
+        if recorder is not None:
+            recorder.record_transition(state, action, next_state, reward, cached)
         if verbose:
             print(f"Next State: {next_state}, Reward: {reward}")
             print_grid(env, next_state)
@@ -73,6 +100,9 @@ def run_episode(env, simulator, max_iterations, verbose=False):
         print(f"\nEpisode ended after {steps} steps.")
         print(f"Total reward: {total_reward}")
 
+    if recorder is not None:
+        recorder.end_episode(env.is_goal(state), steps, total_reward)
+
     episode_time = time.time() - start_time
     return env.is_goal(state), steps, total_reward, episode_time, state
 
@@ -126,6 +156,17 @@ def read_custom_map(file_path):
 def main():
     parser = argparse.ArgumentParser(description="Run MCTS on FrozenLake environment")
     parser.add_argument("-v", "--verbose", action="store_true", help="Increase output verbosity")
+    parser.add_argument("--slippery", action="store_true", help="Use FrozenLake's slippery dynamics")
+    parser.add_argument("--slip-model", choices=SLIP_MODELS, default=None,
+                        help="Transition model used by the planner's simulator")
+    parser.add_argument("--plan-cache", action="store_true",
+                        help="Reuse the principal variation of earlier searches while it stays confident")
+    parser.add_argument("--plan-confidence", type=float, default=0.5,
+                        help="Minimum plan confidence (product of the visit shares and outcome "
+                             "probabilities of the steps followed so far) for a cached plan to be followed")
+    parser.add_argument("--trace", help="Record per-step planner statistics to this binary trace file")
+    parser.add_argument("--trace-paths", type=float, default=0.0,
+                        help="Fraction of search iterations whose paths are also traced")
     args = parser.parse_args()
 
     random.seed(42)
@@ -150,17 +191,17 @@ def main():
       
       if os.path.isfile(custom_map_file):
           custom_map = read_custom_map(custom_map_file)
-          gym_env = gym.make('FrozenLake-v1', desc=custom_map, is_slippery=False)
+          gym_env = gym.make('FrozenLake-v1', desc=custom_map, is_slippery=args.slippery)
       else:
           print(f"Custom map file '{custom_map_file}' not found. Using default 4x4 map.")
           map_choice = '4x4'
 
     if map_choice != 'custom':
         env_name, map_name = maps[map_choice]
-        gym_env = gym.make(env_name, map_name=map_name, is_slippery=False)
+        gym_env = gym.make(env_name, map_name=map_name, is_slippery=args.slippery)
 
-    env = EnvironmentWrapper(env=gym_env)
-    simulator = SimulatorWrapper(env=gym_env)
+    env = EnvironmentWrapper(env=gym_env, is_slippery=args.slippery)
+    simulator = SimulatorWrapper(env=gym_env, is_slippery=args.slippery, slip_model=args.slip_model)
 
     print("\nInitial grid state:")
     print_grid(env, env.reset())
@@ -174,15 +215,28 @@ def main():
     times_list = []
     final_state = None
 
-    for episode in range(num_episodes):
-        success, steps, reward, episode_time, state = run_episode(env, simulator, max_iterations, verbose=args.verbose)
-        successes.append(int(success))
-        steps_list.append(steps)
-        rewards_list.append(reward)
-        times_list.append(episode_time)
-        final_state = state
+    recorder = TraceRecorder(args.trace, path_sample_rate=args.trace_paths) if args.trace else None
+    plan_cache = PlanCache(min_confidence=args.plan_confidence) if args.plan_cache else None
+
+    try:
+        for episode in range(num_episodes):
+            success, steps, reward, episode_time, state = run_episode(env, simulator, max_iterations,
+                                                                      verbose=args.verbose, recorder=recorder,
+                                                                      plan_cache=plan_cache)
+            successes.append(int(success))
+            steps_list.append(steps)
+            rewards_list.append(reward)
+            times_list.append(episode_time)
+            final_state = state
         
-        print(f"Episode {episode + 1}: {'Success' if success else 'Failure'}")
+            print(f"Episode {episode + 1}: {'Success' if success else 'Failure'}")
+            if plan_cache is not None:
+                print(f"  Plan cache: {plan_cache.hits}/{plan_cache.lookups} hits "
+                      f"({plan_cache.hit_rate() * 100:.1f}%), {plan_cache.saved_iterations} iterations saved")
+    finally:
+        if recorder is not None:
+            recorder.close()
+            print(f"Trace written to {args.trace}")
 
     success_rate = sum(successes) / num_episodes * 100
     avg_steps = sum(steps_list) / num_episodes
@@ -1,6 +1,7 @@
-from model import MonteCarloTreeSearch
+from model import MonteCarloTreeSearch, replan_budget
 from environment_wrapper import EnvironmentWrapper, SimulatorWrapper
 import random
+from collections import defaultdict
 # import pdb; pdb.set_trace()
 
 GREEN = "\033[92m"
@@ -35,6 +36,7 @@ def main():
     done = False
     total_reward = 0
     steps = 0
+    visits = defaultdict(int)
 
     action_names = {0: "Left", 1: "Down", 2: "Right", 3: "Up"}
 
@@ -42,7 +44,12 @@ def main():
         print(f"\nStep {steps}, Current State: {state}")
         print_grid(env, state)
         
-        action = mcts.monte_carlo_planning(state, max_iterations=max_iterations)
+        visits[state] += 1
+        budget = replan_budget(visits[state], max_iterations)
+        if budget > max_iterations:
+            print(f"Oscillation detected at state {state}, replanning with {budget} iterations")
+        
+        action = mcts.monte_carlo_planning(state, max_iterations=budget)
         action_name = action_names[action]
         print(f"Chosen action: {action} ({action_name})")
         
@@ -0,0 +1,75 @@
+# Each plan is the principal variation of one search, stored as a sequence keyed
+# by (map hash, state the plan starts from). The runner follows one plan at a
+# time. Its confidence is the product of the visit share of every step taken
+# so far and the probability of every outcome the plan relied on. So it drops
+# as the plan gets older, and the runner searches again once it falls below
+# `min_confidence`.
+class PlanCache:
+    def __init__(self, min_confidence=0.5):
+        self.min_confidence = min_confidence
+        self.plans = {}
+        self.active = None
+        self.position = 0
+        self.confidence = 1.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.lookups = 0
+        self.hits = 0
+        self.saved_iterations = 0
+
+    def start_episode(self):
+        self.active = None
+        self.reset_stats()
+
+    def store(self, map_hash, plan):
+        # Called after searching from plan[0]; its first action is already taken.
+        self.active = None
+        if not plan:
+            return
+        for state, _, _, _, _ in plan:
+            self.plans.pop((map_hash, state), None)
+        key = (map_hash, plan[0][0])
+        self.plans[key] = plan
+        self.active = key
+        self.position = 1
+        self.confidence = plan[0][3] * plan[0][4]
+
+    def discard(self):
+        if self.active is not None:
+            self.plans.pop(self.active, None)
+        self.active = None
+
+    def lookup(self, map_hash, state, iterations):
+        self.lookups += 1
+        if self.active is not None:
+            plan = self.plans[self.active]
+            if self.position >= len(plan):
+                self.active = None
+            elif plan[self.position][0] != state:
+                # The real transition left the plan.
+                self.discard()
+            elif self.confidence * plan[self.position][3] < self.min_confidence:
+                self.active = None
+        if self.active is None:
+            # Fall back to a stored plan that starts here, if there is one.
+            if (map_hash, state) not in self.plans:
+                return None
+            self.active = (map_hash, state)
+            self.position = 0
+            self.confidence = 1.0
+
+        plan = self.plans[self.active]
+        _, action, _, confidence, prob = plan[self.position]
+        if self.confidence * confidence < self.min_confidence:
+            self.active = None
+            return None
+
+        self.hits += 1
+        self.saved_iterations += iterations
+        self.confidence *= confidence * prob
+        self.position += 1
+        return action
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
@@ -0,0 +1,278 @@
+import argparse
+import csv
+import queue
+import random
+import struct
+import sys
+import threading
+import zlib
+
+MAGIC = b'MCTSTRC1'
+CHUNK_HEADER = struct.Struct('<II')
+
+EPISODE_START = 1
+STEP = 2
+PATH = 3
+EPISODE_END = 4
+TRANSITION = 5
+
+EPISODE_START_RECORD = struct.Struct('<BI')
+STEP_RECORD = struct.Struct('<BIIIBIdB')
+EDGE_RECORD = struct.Struct('<BId')
+PATH_RECORD = struct.Struct('<BIIH')
+PATH_STATE = struct.Struct('<I')
+EPISODE_END_RECORD = struct.Struct('<BIBId')
+TRANSITION_RECORD = struct.Struct('<BIIIBIdB')
+
+_STOP = object()
+
+# Records are packed into a chunk on the planning thread and compressed and
+# written by a background thread. At most `max_pending_chunks` full chunks wait
+# for the writer; beyond that the planner blocks until it catches up. If a write
+# fails, recording is turned off and the writer keeps draining the queue so the
+# planner never blocks on a dead writer.
+class TraceRecorder:
+    def __init__(self, path, chunk_size=64 * 1024, max_pending_chunks=8,
+                 path_sample_rate=0.0, compression_level=6):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.path_sample_rate = path_sample_rate
+        self.compression_level = compression_level
+
+        self.episode = -1
+        self.step = 0
+        self.buffer = bytearray()
+        self.buffer_records = 0
+        self.closed = False
+        self.error = None
+        self.enabled = True
+
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.pending = queue.Queue(maxsize=max_pending_chunks)
+        self.writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self.writer.start()
+
+    def _write_chunks(self):
+        while True:
+            item = self.pending.get()
+            if item is _STOP:
+                break
+            if self.error is not None:
+                continue
+            payload, count = item
+            try:
+                compressed = zlib.compress(bytes(payload), self.compression_level)
+                self.file.write(CHUNK_HEADER.pack(len(compressed), count))
+                self.file.write(compressed)
+            except Exception as error:
+                self.error = error
+        try:
+            self.file.close()
+        except Exception as error:
+            if self.error is None:
+                self.error = error
+
+    def _check_writer(self):
+        if self.enabled and self.error is not None:
+            self.enabled = False
+            self.buffer = bytearray()
+            self.buffer_records = 0
+            print(f"Trace recording to {self.path} disabled: {self.error}", file=sys.stderr)
+        return self.enabled
+
+    def _append(self, data):
+        if not self._check_writer():
+            return
+        self.buffer += data
+        self.buffer_records += 1
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._check_writer() and self.buffer_records:
+            self.pending.put((self.buffer, self.buffer_records))
+            self.buffer = bytearray()
+            self.buffer_records = 0
+
+    def start_episode(self):
+        self.episode += 1
+        self.step = 0
+        self._append(EPISODE_START_RECORD.pack(EPISODE_START, self.episode))
+
+    def set_step(self, step):
+        self.step = step
+
+    def record_step(self, state, action, iterations, wall_time, edges):
+        data = bytearray(STEP_RECORD.pack(STEP, self.episode, self.step, state, action,
+                                          iterations, wall_time, len(edges)))
+        for edge_action, visits, value in edges:
+            data += EDGE_RECORD.pack(edge_action, visits, value)
+        self._append(data)
+
+    def record_transition(self, state, action, next_state, reward, cached=False):
+        self._append(TRANSITION_RECORD.pack(TRANSITION, self.episode, self.step, state, action,
+                                            next_state, reward, int(cached)))
+
+    def should_sample_path(self):
+        return self.path_sample_rate > 0 and random.random() < self.path_sample_rate
+
+    def record_path(self, states):
+        states = states[:0xFFFF]
+        data = bytearray(PATH_RECORD.pack(PATH, self.episode, self.step, len(states)))
+        for state in states:
+            data += PATH_STATE.pack(state)
+        self._append(data)
+
+    def end_episode(self, success, steps, total_reward):
+        self._append(EPISODE_END_RECORD.pack(EPISODE_END, self.episode, int(success),
+                                             steps, total_reward))
+        self.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.pending.put(_STOP)
+        self.writer.join()
+        self._check_writer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _decode_chunk(payload):
+    offset = 0
+    while offset < len(payload):
+        kind = payload[offset]
+        if kind == EPISODE_START:
+            _, episode = EPISODE_START_RECORD.unpack_from(payload, offset)
+            offset += EPISODE_START_RECORD.size
+            yield {'type': 'episode_start', 'episode': episode}
+        elif kind == STEP:
+            (_, episode, step, state, action, iterations,
+             wall_time, n_edges) = STEP_RECORD.unpack_from(payload, offset)
+            offset += STEP_RECORD.size
+            edges = []
+            for _ in range(n_edges):
+                edges.append(EDGE_RECORD.unpack_from(payload, offset))
+                offset += EDGE_RECORD.size
+            yield {'type': 'step', 'episode': episode, 'step': step, 'state': state,
+                   'action': action, 'iterations': iterations, 'wall_time': wall_time,
+                   'edges': edges}
+        elif kind == PATH:
+            _, episode, step, length = PATH_RECORD.unpack_from(payload, offset)
+            offset += PATH_RECORD.size
+            states = [PATH_STATE.unpack_from(payload, offset + i * PATH_STATE.size)[0]
+                      for i in range(length)]
+            offset += length * PATH_STATE.size
+            yield {'type': 'path', 'episode': episode, 'step': step, 'states': states}
+        elif kind == EPISODE_END:
+            _, episode, success, steps, total_reward = EPISODE_END_RECORD.unpack_from(payload, offset)
+            offset += EPISODE_END_RECORD.size
+            yield {'type': 'episode_end', 'episode': episode, 'success': bool(success),
+                   'steps': steps, 'total_reward': total_reward}
+        elif kind == TRANSITION:
+            (_, episode, step, state, action, next_state,
+             reward, cached) = TRANSITION_RECORD.unpack_from(payload, offset)
+            offset += TRANSITION_RECORD.size
+            yield {'type': 'transition', 'episode': episode, 'step': step, 'state': state,
+                   'action': action, 'next_state': next_state, 'reward': reward,
+                   'cached': bool(cached)}
+        else:
+            raise ValueError(f"Unknown trace record type {kind} at offset {offset}.")
+
+def read_trace(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not an MCTS trace file.")
+        while True:
+            header = file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            length, _ = CHUNK_HEADER.unpack(header)
+            compressed = file.read(length)
+            if len(compressed) < length:
+                # Truncated final chunk, e.g. the process died mid-write.
+                return
+            yield from _decode_chunk(zlib.decompress(compressed))
+
+def replay_episode(path, episode):
+    return [record for record in read_trace(path) if record.get('episode') == episode]
+
+def _step_rows(step_record, transition):
+    base = {'episode': None, 'step': None, 'state': None, 'chosen_action': None,
+            'next_state': None, 'reward': None, 'cached': None,
+            'iterations': None, 'wall_time': None}
+    for record in (step_record, transition):
+        if record is not None:
+            base.update({'episode': record['episode'], 'step': record['step'],
+                         'state': record['state'], 'chosen_action': record['action']})
+    if transition is not None:
+        base.update({'next_state': transition['next_state'], 'reward': transition['reward'],
+                     'cached': transition['cached']})
+    if step_record is not None:
+        base.update({'iterations': step_record['iterations'], 'wall_time': step_record['wall_time']})
+    if step_record is None or not step_record['edges']:
+        return [dict(base, edge_action=None, edge_visits=None, edge_value=None)]
+    return [dict(base, edge_action=a, edge_visits=n, edge_value=q) for a, n, q in step_record['edges']]
+
+def trace_to_rows(path):
+    # One row per root edge of every episode step, ready for pandas.DataFrame(rows).
+    # Steps taken from the plan cache have no search and get a single row.
+    rows = []
+    searches = {}
+    for record in read_trace(path):
+        key = (record['episode'], record.get('step'))
+        if record['type'] == 'step':
+            searches[key] = record
+        elif record['type'] == 'transition':
+            rows.extend(_step_rows(searches.pop(key, None), record))
+    for step_record in searches.values():
+        rows.extend(_step_rows(step_record, None))
+    return rows
+
+def print_episode(records):
+    for record in records:
+        if record['type'] == 'episode_start':
+            print(f"Episode {record['episode']}")
+        elif record['type'] == 'step':
+            edges = ', '.join(f"{a}: N={n} Q={q:.3f}" for a, n, q in record['edges'])
+            print(f"  Step {record['step']}, State {record['state']} -> action {record['action']} "
+                  f"({record['iterations']} iterations, {record['wall_time']:.3f}s) [{edges}]")
+        elif record['type'] == 'transition':
+            source = 'cached plan' if record['cached'] else 'search'
+            print(f"  Step {record['step']}, State {record['state']} --{record['action']}--> "
+                  f"{record['next_state']}, reward {record['reward']:.2f} ({source})")
+        elif record['type'] == 'path':
+            print(f"    Sampled path at step {record['step']}: {' -> '.join(str(s) for s in record['states'])}")
+        elif record['type'] == 'episode_end':
+            outcome = 'Success' if record['success'] else 'Failure'
+            print(f"  {outcome} after {record['steps']} steps, total reward {record['total_reward']:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect an MCTS trace file")
+    parser.add_argument("trace", help="Trace file written by TraceRecorder")
+    parser.add_argument("-e", "--episode", type=int, help="Only replay this episode")
+    parser.add_argument("--csv", help="Write one row per root edge and step to this CSV file")
+    args = parser.parse_args()
+
+    if args.csv:
+        rows = trace_to_rows(args.trace)
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote {len(rows)} rows to {args.csv}", file=sys.stderr)
+        return
+
+    if args.episode is not None:
+        print_episode(replay_episode(args.trace, args.episode))
+    else:
+        print_episode(read_trace(args.trace))
+
+if __name__ == "__main__":
+    main()